@@ -1,11 +1,19 @@
 import numpy as np
 import pandas as pd
 
-import datetime, os, queue, sys
+import bisect, datetime, heapq, logging, os, sys
+from concurrent.futures import ThreadPoolExecutor
 from message.Message import Message, MessageType
 
+from util import util
 from util.util import print
 
+# Per-event kernel output goes through this logger rather than print(), so that
+# when muted each call site costs only a flag check and no string formatting.
+# The kernel never configures the logger; handlers and levels belong to the
+# application (see stumpgrinder.py).
+log = logging.getLogger(__name__)
+
 class Kernel:
 
   def __init__(self, kernel_name):
@@ -13,16 +21,38 @@ class Kernel:
     self.name = kernel_name
     print ("Kernel initialized: {}".format(self.name))
 
-    self.messages = queue.PriorityQueue()
+    # Whether to emit per-event debug output, decided when the run starts.
+    self.logDebug = False
+
+    # Agent IDs by class, filled in by runner() once the agents are known.
+    self.agentsByType = {}
+
+    # The event queue is a plain list managed by heapq (the kernel is single
+    # threaded, so it does not need the locking of queue.PriorityQueue).  Entries
+    # are flat (time, seq, recipient, message type, message) tuples.  The
+    # increasing seq breaks ties between events at the same time in FIFO order,
+    # so heap comparisons are resolved on two ints and never reach the payload.
+    # (A tuple is already a single allocation without a __dict__, and its
+    # comparison runs in C; a slotted Event class would need a Python __lt__.)
+    self.messages = []
+    self._event_seq = 0
 
     # currentTime is None until after kernelStarting() event completes
     # for all agents.  This is a pd.Timestamp that includes the date.
+    # Internally (event queue, agent times) the kernel keeps time as
+    # integer nanoseconds since the epoch, and only creates a pd.Timestamp
+    # when handing the time to an agent.
     self.currentTime = None
 
     # Timestamp at which the Kernel was created.  Primarily used to
     # create a unique log directory for this run.
     self.kernelWallClockStart = pd.Timestamp('now')
 
+    # While agents are terminating, writeLog() hands logs to this pool so
+    # they are compressed and written in parallel.  None at any other time.
+    self.logWriter = None
+    self.logWrites = []
+
     # TODO: This is financial, and so probably should not be here...
     self.meanResultByAgentType = {}
     self.agentCountByType = {}
@@ -36,6 +66,14 @@ class Kernel:
     # agents must be a list of agents for the simulation,
     #        based on class agent.Agent
     self.agents = agents
+
+    # Index agent IDs by every class in each agent's MRO, so findAgentByType()
+    # does not need to scan the agent list.  Agents are visited in list order, so
+    # each class's IDs are in agent order as well.
+    self.agentsByType = {}
+    for agent in agents:
+      for cls in type(agent).__mro__:
+        self.agentsByType.setdefault(cls, []).append(agent.id)
     self.startTime = startTime
     self.stopTime = stopTime
     self.seed = seed
@@ -54,24 +92,25 @@ class Kernel:
     # it is still "in the future")
 
     # This also nicely enforces agents being unable to act before
-    # the simulation startTime.
-    self.agentCurrentTimes = [self.startTime] * len(agents)
+    # the simulation startTime.  Stored as int64 nanoseconds.
+    self.agentCurrentTimesNs = np.full(len(agents), self.startTime.value, dtype=np.int64)
 
     # agentComputationDelays is in nanoseconds, starts with a default
     # value from config, and can be changed by any agent at any time
     # (for itself only).  It represents the time penalty applied to
     # an agent each time it is awakened  (wakeup or recvMsg).  The
     # penalty applies _after_ the agent acts, before it may act again.
-    # TODO: this might someday change to pd.Timedelta objects.
-    self.agentComputationDelays = [defaultComputationDelay] * len(agents)
+    # Like agent times, these are kept in an int64 array so the per-event
+    # arithmetic is plain integer math.
+    self.agentComputationDelaysNs = np.full(len(agents), defaultComputationDelay, dtype=np.int64)
 
     # If agentLatency is not defined, define it using the defaultLatency.
     # This matrix defines the communication delay between every pair of
-    # agents.
+    # agents, in whole nanoseconds, as a 2-D int64 array.
     if agentLatency is None:
-      self.agentLatency = [[defaultLatency] * len(agents)] * len(agents)
+      self.agentLatency = np.full((len(agents), len(agents)), defaultLatency, dtype=np.int64)
     else:
-      self.agentLatency = agentLatency
+      self.agentLatency = np.asarray(agentLatency, dtype=np.int64)
 
     # There is a noise model for latency, intended to be a one-sided
     # distribution with the peak at zero.  By default there is no noise
@@ -79,6 +118,21 @@ class Kernel:
     # list index = ns extra delay, value = probability of this delay.
     self.latencyNoise = latencyNoise
 
+    # Noise is drawn by inverting the cumulative distribution of latencyNoise
+    # (computed once here) with a uniform sample from a dedicated random stream.
+    # With a single entry there is nothing to draw, and noise is always zero.
+    # The stream is seeded from the global numpy RNG unless a seed was given,
+    # so configs that only call np.random.seed() remain reproducible.
+    if len(latencyNoise) > 1:
+      if seed is None: seed = np.random.randint(low = 0, high = 2**31 - 1)
+      self.latencyNoiseRandomState = np.random.RandomState(seed)
+
+      cdf = np.cumsum(np.asarray(latencyNoise, dtype=np.float64))
+      self.latencyNoiseCdf = (cdf / cdf[-1]).tolist()
+      self.latencyNoiseCdf[-1] = 1.0
+    else:
+      self.latencyNoiseCdf = None
+
     # The kernel maintains an accumulating additional delay parameter
     # for the current agent.  This is applied to each message sent
     # and upon return from wakeup/receiveMessage, in addition to the
@@ -87,6 +141,10 @@ class Kernel:
     # staggering of sent messages.
     self.currentAgentAdditionalDelay = 0
 
+    # Per-event debug output is emitted only if silent mode is off (as for print())
+    # and the logger is enabled for DEBUG.
+    self.logDebug = logDebug = (not util.silent_mode) and log.isEnabledFor(logging.DEBUG)
+
     print ("Kernel started: {}".format(self.name))
     print ("Simulation started!")
 
@@ -121,98 +179,121 @@ class Kernel:
       # Start processing the Event Queue.
       print ("\n--- Kernel Event Queue begins ---")
       print ("Kernel will start processing messages. ",
-             "Queue length: {}".format(len(self.messages.queue)))
+             "Queue length: {}".format(len(self.messages)))
 
       # Track starting wall clock time and total message count for stats at the end.
       eventQueueWallClockStart = pd.Timestamp('now')
       ttl_messages = 0
 
-      # Process messages.
-      while not self.messages.empty() and self.currentTime and (self.currentTime <= self.stopTime):
-        self.currentTime, event = self.messages.get()
-        msg_recipient, msg_type, msg = event
+      currentTimeNs = self.currentTime.value
+      stopTimeNs = self.stopTime.value
+
+      # Process messages.  All events queued for the same time are popped
+      # together and dispatched in order as one batch, so the per-time work
+      # (Timestamp creation, periodic status output) is done once per batch.
+      # Events queued during the batch for this same time (e.g. with zero
+      # latency) sort after it and are handled by the next batch.
+      #
+      # Events within a batch are dispatched serially, even for distinct
+      # recipients.  Agents share kernel state while they run (the single
+      # event queue, currentAgentAdditionalDelay, and the global numpy RNG
+      # that keeps runs reproducible from one seed), and the GIL would keep
+      # pure-Python agent code from running concurrently in any case.
+      nextStatusMessages = 0
+
+      # Loop invariants are bound to locals to avoid repeated attribute and
+      # global lookups on every event.
+      messages = self.messages
+      heappop = heapq.heappop
+      heappush = heapq.heappush
+      agentTimes = self.agentCurrentTimesNs
+      agentDelays = self.agentComputationDelaysNs
+
+      # Likewise pre-bind each agent's event handlers, indexed by agent ID.
+      wakeupFns = [ a.wakeup for a in agents ]
+      receiveFns = [ a.receiveMessage for a in agents ]
+
+      # Handling differs by message type only in which agent method is
+      # called, so dispatch through a table indexed by MessageType value.
+      # Each entry is (handlers by agent ID, whether to pass msg, label).
+      dispatchTable = [None] * (max(t.value for t in MessageType) + 1)
+      dispatchTable[MessageType.WAKEUP.value] = (wakeupFns, False, 'wakeup')
+      dispatchTable[MessageType.MESSAGE.value] = (receiveFns, True, 'message')
+
+      while messages and (currentTimeNs <= stopTimeNs):
+        event = heappop(messages)
+        currentTimeNs = event[0]
+        batch = [event]
+        while messages and messages[0][0] == currentTimeNs:
+          batch.append(heappop(messages))
+
+        self.currentTime = pd.Timestamp(currentTimeNs)
 
         # Periodically print the simulation time and total messages, even if muted.
-        if ttl_messages % 100000 == 0:
+        if ttl_messages >= nextStatusMessages:
           print ("\n--- Simulation time: {}, messages processed: {}, wallclock elapsed: {} ---\n".format(
-                         self.fmtTime(self.currentTime), ttl_messages, pd.Timestamp('now') - eventQueueWallClockStart),
+                         self.currentTime, ttl_messages, pd.Timestamp('now') - eventQueueWallClockStart),
                  override=True)
+          nextStatusMessages = (ttl_messages // 100000 + 1) * 100000
 
-        print ("\n--- Kernel Event Queue pop ---")
-        print ("Kernel handling {} message for agent {} at time {}".format(
-               msg_type, msg_recipient, self.fmtTime(self.currentTime)))
+        for _, _, msg_recipient, msg_type, msg in batch:
+          if logDebug:
+            log.debug("\n--- Kernel Event Queue pop ---")
+            log.debug("Kernel handling %s message for agent %s at time %s",
+                      msg_type, msg_recipient, self.currentTime)
 
-        ttl_messages += 1
+          ttl_messages += 1
 
-        # In between messages, always reset the currentAgentAdditionalDelay.
-        self.currentAgentAdditionalDelay = 0
+          # In between messages, always reset the currentAgentAdditionalDelay.
+          self.currentAgentAdditionalDelay = 0
 
-        # Dispatch message to agent.
-        if msg_type == MessageType.WAKEUP:
+          # Dispatch message to agent.
+          entry = dispatchTable[msg_type.value]
+          if entry is None:
+            raise ValueError("Unknown message type found in queue",
+                             "currentTime:", self.currentTime,
+                             "messageType:", msg_type)
+          handlers, passMsg, label = entry
 
-          # Who requested this wakeup call?
+          # Who is this event for?
           agent = msg_recipient
 
           # Test to see if the agent is already in the future.  If so,
-          # delay the wakeup until the agent can act again.
-          if self.agentCurrentTimes[agent] > self.currentTime:
-            # Push the wakeup call back into the PQ with a new time.
-            self.messages.put((self.agentCurrentTimes[agent],
-                              (msg_recipient, msg_type, msg)))
-            print ("Agent in future: wakeup requeued for {}".format(
-                 self.fmtTime(self.agentCurrentTimes[agent])))
-            continue
-            
-          # Set agent's current time to global current time for start
-          # of processing.
-          self.agentCurrentTimes[agent] = self.currentTime
-
-          # Wake the agent.
-          agents[agent].wakeup(self.currentTime)
-
-          # Delay the agent by its computation delay plus any transient additional delay requested.
-          self.agentCurrentTimes[agent] += pd.Timedelta(self.agentComputationDelays[agent] +
-                                                        self.currentAgentAdditionalDelay)
-
-          print ("After wakeup return, agent {} delayed from {} to {}".format(
-                 agent, self.fmtTime(self.currentTime), self.fmtTime(self.agentCurrentTimes[agent])))
-
-        elif msg_type == MessageType.MESSAGE:
-
-          # Who is receiving this message?
-          agent = msg_recipient
-
-          # Test to see if the agent is already in the future.  If so,
-          # delay the message until the agent can act again.
-          if self.agentCurrentTimes[agent] > self.currentTime:
-            # Push the message back into the PQ with a new time.
-            self.messages.put((self.agentCurrentTimes[agent],
-                              (msg_recipient, msg_type, msg)))
-            print ("Agent in future: message requeued for {}".format(
-                 self.fmtTime(self.agentCurrentTimes[agent])))
-            #print ("TMP: delayed message was: {}".format(msg))
+          # delay the event until the agent can act again.  (Events are
+          # queued no earlier than the agent's time when scheduled, so this
+          # only happens if the agent has acted again since then.)
+          if agentTimes[agent] > currentTimeNs:
+            # Push the event back into the PQ with a new time.  (The event
+            # is deferred rather than cancelled, so it must be queued again;
+            # marking it stale and skipping it later would only add a set
+            # lookup to every pop.)
+            heappush(messages, (int(agentTimes[agent]), self._event_seq,
+                                msg_recipient, msg_type, msg))
+            self._event_seq += 1
+            if logDebug:
+              log.debug("Agent in future: %s requeued for %s",
+                        label, pd.Timestamp(agentTimes[agent]))
             continue
 
           # Set agent's current time to global current time for start
           # of processing.
-          self.agentCurrentTimes[agent] = self.currentTime
+          agentTimes[agent] = currentTimeNs
 
-          # Deliver the message.
-          agents[agent].receiveMessage(self.currentTime, msg)
+          # Wake the agent or deliver the message.
+          if passMsg:
+            handlers[agent](self.currentTime, msg)
+          else:
+            handlers[agent](self.currentTime)
 
           # Delay the agent by its computation delay plus any transient additional delay requested.
-          self.agentCurrentTimes[agent] += pd.Timedelta(self.agentComputationDelays[agent] +
-                                                        self.currentAgentAdditionalDelay)
-
-          print ("After receiveMessage return, agent {} delayed from {} to {}".format(
-                 agent, self.fmtTime(self.currentTime), self.fmtTime(self.agentCurrentTimes[agent])))
+          agentTimes[agent] += (agentDelays[agent] +
+                                self.currentAgentAdditionalDelay)
 
-        else:
-          raise ValueError("Unknown message type found in queue",
-                           "currentTime:", self.currentTime,
-                           "messageType:", self.msg.type)
+          if logDebug:
+            log.debug("After %s return, agent %s delayed from %s to %s",
+                      label, agent, self.currentTime, pd.Timestamp(agentTimes[agent]))
 
-      if self.messages.empty():
+      if not messages:
         print ("\n--- Kernel Event Queue empty ---")
 
       if self.currentTime and (self.currentTime > self.stopTime):
@@ -236,9 +317,18 @@ class Kernel:
       # is unknown).  Agents should clean up all used resources as the
       # simulation program may not actually terminate if num_simulations > 1.
       print ("\n--- Agent.kernelTerminating() ---")
+      self.logWriter = ThreadPoolExecutor(max_workers=os.cpu_count())
       for agent in agents:
         agent.kernelTerminating()
 
+      # Wait for all agent logs to be written.  result() re-raises any error
+      # from the writing thread here.
+      self.logWriter.shutdown(wait=True)
+      for write in self.logWrites:
+        write.result()
+      self.logWriter = None
+      self.logWrites = []
+
       print ("Event Queue elapsed: {}, messages: {}, messages per second: {:0.1f}".format(
              eventQueueWallClockElapsed, ttl_messages, 
              ttl_messages / (eventQueueWallClockElapsed / (np.timedelta64(1, 's')))),
@@ -292,19 +382,31 @@ class Kernel:
     # This means message delay (before latency) is the agent's standard computation delay
     # PLUS any accumulated delay for this wake cycle PLUS any one-time requested delay
     # for this specific message only.
-    sentTime = self.currentTime + pd.Timedelta(self.agentComputationDelays[sender] + 
-                                               self.currentAgentAdditionalDelay + delay)
+    sentTime = self.currentTime.value + int(self.agentComputationDelaysNs[sender] +
+                                            self.currentAgentAdditionalDelay + delay)
 
     # Apply communication delay per the agentLatency matrix [sender][recipient].
-    latency = self.agentLatency[sender][recipient]
-    noise = np.random.choice(len(self.latencyNoise), 1, self.latencyNoise)[0]
-    deliverAt = sentTime + pd.Timedelta(latency + noise)
+    # Delivery time is in integer nanoseconds, like all queued event times.
+    latency = int(self.agentLatency[sender, recipient])
+    if self.latencyNoiseCdf is None:
+      noise = 0
+    else:
+      noise = bisect.bisect(self.latencyNoiseCdf, self.latencyNoiseRandomState.random_sample())
+    deliverAt = sentTime + latency + noise
 
-    self.messages.put((deliverAt, (recipient, MessageType.MESSAGE, msg)))
+    # A message cannot be handled while the recipient is still "in the future",
+    # so queue it for the recipient's next available time straight away rather
+    # than having the runner pop and requeue it.
+    deliverAt = max(deliverAt, int(self.agentCurrentTimesNs[recipient]))
 
-    print ("Kernel applied latency {}, noise {}, accumulated delay {}, one-time delay {} on sendMessage from: {} to {}, scheduled for {}".format(
-           latency, noise, self.currentAgentAdditionalDelay, delay, self.agents[sender].name, self.agents[recipient].name, self.fmtTime(deliverAt)))
-    print ("Message queued: {}".format(msg))
+    heapq.heappush(self.messages, (deliverAt, self._event_seq,
+                                   recipient, MessageType.MESSAGE, msg))
+    self._event_seq += 1
+
+    if self.logDebug:
+      log.debug("Kernel applied latency %s, noise %s, accumulated delay %s, one-time delay %s on sendMessage from: %s to %s, scheduled for %s",
+                latency, noise, self.currentAgentAdditionalDelay, delay, self.agents[sender].name, self.agents[recipient].name, pd.Timestamp(deliverAt))
+      log.debug("Message queued: %s", msg)
 
 
   def setWakeup(self, sender = None, requestedTime = None):
@@ -316,7 +418,7 @@ class Kernel:
     # kernel will not supply any parameters to the wakeup() call.
 
     if requestedTime is None:
-        requestedTime = self.currentTime + pd.TimeDelta(1)
+        requestedTime = self.currentTime + pd.Timedelta(1)
 
     if sender is None:
       raise ValueError("setWakeup() called without valid sender ID",
@@ -327,16 +429,20 @@ class Kernel:
                        "currentTime:", self.currentTime,
                        "requestedTime:", requestedTime)
 
-    print ("Kernel adding wakeup for agent {} at time {}".format(
-           sender, self.fmtTime(requestedTime)))
+    if self.logDebug:
+      log.debug("Kernel adding wakeup for agent %s at time %s", sender, requestedTime)
+
+    # As in sendMessage(), never queue the wakeup before the agent can act.
+    wakeAt = max(requestedTime.value, int(self.agentCurrentTimesNs[sender]))
 
-    self.messages.put((requestedTime,
-                      (sender, MessageType.WAKEUP, None)))
+    heapq.heappush(self.messages, (wakeAt, self._event_seq,
+                                   sender, MessageType.WAKEUP, None))
+    self._event_seq += 1
 
 
   def getAgentComputeDelay(self, sender = None):
     # Allows an agent to query its current computation delay.
-    return self.agentComputationDelays[sender]
+    return int(self.agentComputationDelaysNs[sender])
 
 
   def setAgentComputeDelay(self, sender = None, requestedDelay = None):
@@ -361,7 +467,7 @@ class Kernel:
       raise ValueError("Requested computation delay must be non-negative nanoseconds.",
                        "requestedDelay:", requestedDelay)
 
-    self.agentComputationDelays[sender] = requestedDelay
+    self.agentComputationDelaysNs[sender] = requestedDelay
 
 
 
@@ -389,11 +495,18 @@ class Kernel:
   def findAgentByType(self, type = None):
     # Called to request an arbitrary agent ID that matches the class or base class
     # passed as "type".  For example, any ExchangeAgent, or any NasdaqExchangeAgent.
-    # This method is rather expensive, so the results should be cached by the caller!
+    # Returns the first such agent in agent order, or None if there is no such agent.
+    # Only valid once runner() has started:  before that, no agents are known.
+
+    agents = self.agentsByType.get(type)
+    return agents[0] if agents else None
+
 
-    for agent in self.agents:
-      if isinstance(agent, type):
-        return agent.id
+  def findAllAgentsByType(self, type = None):
+    # As findAgentByType(), but returns a list of the IDs of all agents that match
+    # the class or base class passed as "type".  (Empty if there are none.)
+
+    return list(self.agentsByType.get(type, []))
 
 
   def writeLog (self, sender, dfLog, filename=None):
@@ -413,35 +526,21 @@ class Kernel:
     # the Kernel will construct a filename based on the name of the Agent
     # requesting log archival.
 
+    # Logs are gzip compressed pickles, which write several times faster than
+    # bz2.  During kernelTerminating() the write is queued to a thread pool,
+    # so one agent's log compresses while the next agent builds its dataframe.
+
     path = os.path.join(".", "log", self.log_dir)
 
     if filename:
-      file = "{}.bz2".format(filename)
+      file = "{}.gz".format(filename)
     else:
-      file = "{}.bz2".format(self.agents[sender].name.replace(" ",""))
-
-    if not os.path.exists(path):
-      os.makedirs(path)
-
-    dfLog.to_pickle(os.path.join(path, file), compression='bz2')
+      file = "{}.gz".format(self.agents[sender].name.replace(" ",""))
 
- 
-  @staticmethod
-  def fmtTime(simulationTime):
-    # The Kernel class knows how to pretty-print time.  It is assumed simulationTime
-    # is in nanoseconds since midnight.  Note this is a static method which can be
-    # called either on the class or an instance.
-
-    # Try just returning the pd.Timestamp now.
-    return (simulationTime)
-
-    ns = simulationTime
-    hr = int(ns / (1000000000 * 60 * 60))
-    ns -= (hr * 1000000000 * 60 * 60)
-    m = int(ns / (1000000000 * 60))
-    ns -= (m * 1000000000 * 60)
-    s = int(ns / 1000000000)
-    ns = int(ns - (s * 1000000000))
-
-    return "{:02d}:{:02d}:{:02d}.{:09d}".format(hr, m, s, ns)
+    os.makedirs(path, exist_ok=True)
 
+    if self.logWriter is None:
+      dfLog.to_pickle(os.path.join(path, file), compression='gzip')
+    else:
+      self.logWrites.append(self.logWriter.submit(dfLog.to_pickle, os.path.join(path, file),
+                                                  compression='gzip'))
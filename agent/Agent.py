@@ -1,6 +1,7 @@
 import pandas as pd
 
 from copy import deepcopy
+from util import util
 from util.util import print
 
 class Agent:
@@ -56,8 +57,9 @@ class Agent:
     # Base Agent schedules a wakeup call for the first available timestamp.
     # Subclass agents may override this behavior as needed.
 
-    print ("Agent {} ({}) requesting kernel wakeup at time {}".format(
-           self.id, self.name, self.kernel.fmtTime(startTime)))
+    if not util.silent_mode:
+      print ("Agent {} ({}) requesting kernel wakeup at time {}".format(
+             self.id, self.name, startTime))
 
     self.setWakeup(startTime)
 
@@ -104,8 +106,9 @@ class Agent:
 
     self.currentTime = currentTime
 
-    print ("At {}, agent {} ({}) received: {}".format(
-                  self.kernel.fmtTime(currentTime), self.id, self.name, msg))
+    if not util.silent_mode:
+      print ("At {}, agent {} ({}) received: {}".format(
+                    currentTime, self.id, self.name, msg))
 
 
   def wakeup (self, currentTime):
@@ -115,8 +118,9 @@ class Agent:
 
     self.currentTime = currentTime
 
-    print ("At {}, agent {} ({}) received wakeup.".format(
-                  self.kernel.fmtTime(currentTime), self.id, self.name))
+    if not util.silent_mode:
+      print ("At {}, agent {} ({}) received wakeup.".format(
+                    currentTime, self.id, self.name))
 
 
   ### Methods used to request services from the Kernel.  These should be used
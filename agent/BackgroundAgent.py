@@ -280,7 +280,7 @@ class BackgroundAgent(TradingAgent):
         ask = arb_target
 
     print ("{} believes {} is worth {} at {}, arb target: {}.".format(self.name, self.symbol, 
-           self.dollarize(self.value_belief), self.kernel.fmtTime(self.currentTime),
+           self.dollarize(self.value_belief), self.currentTime,
            self.dollarize(arb_target)))
 
     # The agents now have their desired behavior.  Instead of placing bracketing limit orders, they
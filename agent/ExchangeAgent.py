@@ -11,7 +11,6 @@ import numpy as np
 import pandas as pd
 pd.set_option('display.max_rows', 500)
 
-from copy import deepcopy
 
 class ExchangeAgent(FinancialAgent):
 
@@ -55,8 +54,10 @@ class ExchangeAgent(FinancialAgent):
     self.oracle = self.kernel.oracle
 
     # Obtain opening prices (in integer cents).  These are not noisy right now.
+    # Stored as a plain int (an oracle may return a numpy integer), so agents can
+    # use last trade prices in arithmetic without any conversion.
     for symbol in self.order_books:
-      self.order_books[symbol].last_trade = self.oracle.getDailyOpenPrice(symbol, self.mkt_open)
+      self.order_books[symbol].last_trade = int(self.oracle.getDailyOpenPrice(symbol, self.mkt_open))
       print ("Opening price for {} is {}".format(symbol, self.order_books[symbol].last_trade))
 
 
@@ -80,7 +81,9 @@ class ExchangeAgent(FinancialAgent):
         # only increases in our simulation.  BUT it can have duplicates if multiple orders happen
         # in the same nanosecond.  (This particularly happens if using nanoseconds as the discrete
         # but fine-grained unit for more theoretic studies.)
+        # The logged rows only contain quotes with volume at the time, so fill the rest with zero.
         dfLog = pd.DataFrame(book.book_log)
+        dfLog.fillna(0, inplace=True)
         dfLog.set_index('QuoteTime', inplace=True)
 
         if True:
@@ -230,8 +233,13 @@ class ExchangeAgent(FinancialAgent):
         print ("Bid-ask spread request discarded.  Unknown symbol: {}".format(symbol))
       else:
         print ("{} received QUERY_SPREAD ({}:{}) request from agent {}".format(self.name, symbol, depth, msg.body['sender']))
+        bids = self.order_books[symbol].getInsideBids(depth)
+        asks = self.order_books[symbol].getInsideAsks(depth)
+
+        # Total volume on each side of the reported depth, for the agent's imbalance logging.
         self.sendMessage(msg.body['sender'], Message({ "msg": "QUERY_SPREAD", "symbol": symbol, "depth": depth,
-             "bids": self.order_books[symbol].getInsideBids(depth), "asks": self.order_books[symbol].getInsideAsks(depth),
+             "bids": bids, "asks": asks,
+             "bid_vol_total": sum(qty for _, qty in bids), "ask_vol_total": sum(qty for _, qty in asks),
              "data": self.order_books[symbol].last_trade, "mkt_closed": True if currentTime > self.mkt_close else False,
              "book": self.order_books[symbol].prettyPrint(silent=True) }))
     elif msg.body['msg'] == "QUERY_ORDER_STREAM":
@@ -255,7 +263,7 @@ class ExchangeAgent(FinancialAgent):
       if order.symbol not in self.order_books:
         print ("Order discarded.  Unknown symbol: {}".format(order.symbol))
       else:
-        self.order_books[order.symbol].handleLimitOrder(deepcopy(order))
+        self.order_books[order.symbol].handleLimitOrder(order.clone())
     elif msg.body['msg'] == "CANCEL_ORDER":
       # Note: this is somewhat open to abuse, as in theory agents could cancel other agents' orders.
       # An agent could also become confused if they receive a (partial) execution on an order they
@@ -266,16 +274,21 @@ class ExchangeAgent(FinancialAgent):
       if order.symbol not in self.order_books:
         print ("Cancellation request discarded.  Unknown symbol: {}".format(order.symbol))
       else:
-        self.order_books[order.symbol].cancelOrder(deepcopy(order))
+        self.order_books[order.symbol].cancelOrder(order.clone())
       
 
   def sendMessage (self, recipientID, msg):
     # The ExchangeAgent automatically applies appropriate parallel processing pipeline delay
     # to exactly those message types which require it.
     # TODO: probably organize the order types into constant categories once there are more.
-    if msg.body['msg'] in ['ORDER_ACCEPTED', 'ORDER_CANCELLED', 'ORDER_EXECUTED']:
+    if msg.body['msg'] in ['ORDER_ACCEPTED', 'ORDER_CANCELLED']:
       super().sendMessage(recipientID, msg, delay = self.pipeline_delay)
       self.logEvent(msg.body['msg'], msg.body['order'])
+    elif msg.body['msg'] == 'ORDER_EXECUTED':
+      # Execution notices carry a list of fills.  Log each fill individually.
+      super().sendMessage(recipientID, msg, delay = self.pipeline_delay)
+      for order in msg.body['orders']:
+        self.logEvent(msg.body['msg'], order)
     else:
       super().sendMessage(recipientID, msg)
 
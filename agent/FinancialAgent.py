@@ -1,6 +1,6 @@
 from agent.Agent import Agent
-import sys
-import traceback
+from functools import lru_cache
+import numpy as np
 
 # The FinancialAgent class contains attributes and methods that should be available
 # to all agent types (traders, exchanges, etc) in a financial market simulation.
@@ -21,12 +21,21 @@ class FinancialAgent(Agent):
 # utility access by non-agent classes.
 
 def dollarize(cents):
-  if type(cents) is list:
-    return ( [ dollarize(x) for x in cents ] )
-  elif type(cents) is int:
-    return "${:0.2f}".format(cents / 100)
+  if isinstance(cents, (int, np.integer)) and not isinstance(cents, bool):
+    return dollarize_int(int(cents))
+  elif isinstance(cents, (list, tuple, np.ndarray)):
+    # Format the whole sequence at once in numpy rather than element by element.
+    arr = np.asarray(cents)
+    if arr.size and not np.issubdtype(arr.dtype, np.integer):
+      raise TypeError("dollarize(cents) called with non-int elements: {}".format(cents))
+    return np.char.mod("$%0.2f", arr.astype(np.int64) / 100.0).tolist()
   else:
     # If cents is already a float, there is an error somewhere.
-    print ("ERROR: dollarize(cents) called without int or list of ints: {}".format(cents))
-    traceback.print_stack()
-    sys.exit()
+    raise TypeError("dollarize(cents) called without int or list of ints: {}".format(cents))
+
+
+# Formats a single int-cents price.  A day's trading touches relatively few distinct
+# prices, so the formatted strings are cached.
+@lru_cache(maxsize=4096)
+def dollarize_int(cents):
+  return "${:0.2f}".format(cents / 100)
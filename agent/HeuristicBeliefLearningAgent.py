@@ -1,5 +1,6 @@
 from agent.ZeroIntelligenceAgent import ZeroIntelligenceAgent
 from message.Message import Message
+from util import util
 from util.util import print
 
 from math import sqrt
@@ -51,7 +52,8 @@ class HeuristicBeliefLearningAgent(ZeroIntelligenceAgent):
 
     if len(self.stream_history[self.symbol]) < self.L:
       # Not enough history for HBL.
-      print ("Insufficient history for HBL: length {}, L {}".format(len(self.stream_history[self.symbol]), self.L))
+      if not util.silent_mode:
+        print ("Insufficient history for HBL: length {}, L {}".format(len(self.stream_history[self.symbol]), self.L))
       super().placeOrder()
       return
 
@@ -126,11 +128,12 @@ class HeuristicBeliefLearningAgent(ZeroIntelligenceAgent):
 
     # best_p should now contain the limit price that produces maximum expected surplus best_Es
     if best_Es > 0:
-      print ("{} selects limit price {} with expected surplus {} (Pr = {:0.4f})".format(self.name, best_p, int(round(best_Es)), best_Pr))
+      if not util.silent_mode:
+        print ("{} selects limit price {} with expected surplus {} (Pr = {:0.4f})".format(self.name, best_p, int(round(best_Es)), best_Pr))
 
       # Place the constructed order.
       self.placeLimitOrder(self.symbol, 1, buy, best_p)
-    else:
+    elif not util.silent_mode:
       print ("{} elects not to place an order (best expected surplus <= 0)".format(self.name))
 
 
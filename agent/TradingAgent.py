@@ -2,9 +2,9 @@ from agent.FinancialAgent import FinancialAgent
 from agent.ExchangeAgent import ExchangeAgent
 from message.Message import Message
 from util.order.LimitOrder import LimitOrder
+from util import util
 from util.util import print
 
-from copy import deepcopy
 import numpy as np
 import pandas as pd
 import random
@@ -20,6 +20,10 @@ class TradingAgent(FinancialAgent):
     self.mkt_open = None
     self.mkt_close = None
 
+    # The same times as int ns, for arithmetic on hot paths.
+    self.mkt_open_ns = None
+    self.mkt_close_ns = None
+
     # Store startingCash in case we want to refer to it for performance stats.
     # It should NOT be modified.  Use the 'CASH' key in self.holdings.
     # 'CASH' is always in cents!  Note that agents are limited by their starting
@@ -50,6 +54,10 @@ class TradingAgent(FinancialAgent):
     self.known_bids = {}
     self.known_asks = {}
 
+    # Symbol -> (total bid volume, total ask volume) over the depth last reported
+    # in a spread reply.
+    self.known_vol_totals = {}
+
     self.stream_history = {}
 
     # For special logging at the first moment the simulator kernel begins
@@ -64,6 +72,32 @@ class TradingAgent(FinancialAgent):
     # TMP
     self.book = ''
 
+    # Log a MARK_TO_MARKET event per symbol each time holdings are marked to market
+    # and logged (as well as the MARKED_TO_MARKET total).  Off by default.
+    self.log_mtm_detail = False
+
+    # Current at-risk capital (marked-to-market value of non-CASH holdings), or None
+    # if it must be recomputed.  Holdings and last trade prices only change on execution
+    # and on a new last trade, so those invalidate it.
+    self.cached_at_risk = None
+
+    # Message type -> handler, called with the message body.  The order
+    # callbacks are the methods subclasses should extend:  orderExecuted
+    # could implement default "portfolio tracking" or "returns tracking"
+    # behavior.  MKT_CLOSED means we tried to ask the exchange for something
+    # after it closed, so we remember this and stop asking.
+    self.msg_handlers = {
+      'WHEN_MKT_OPEN'      : self.handleMktOpen,
+      'WHEN_MKT_CLOSE'     : self.handleMktClose,
+      'ORDER_EXECUTED'     : self.handleOrderExecuted,
+      'ORDER_ACCEPTED'     : lambda body: self.orderAccepted(body['order']),
+      'ORDER_CANCELLED'    : lambda body: self.orderCancelled(body['order']),
+      'MKT_CLOSED'         : lambda body: self.marketClosed(),
+      'QUERY_LAST_TRADE'   : self.handleLastTrade,
+      'QUERY_SPREAD'       : self.handleSpread,
+      'QUERY_ORDER_STREAM' : self.handleOrderStream,
+    }
+
 
   # Simulation lifecycle messages.
 
@@ -97,7 +131,7 @@ class TradingAgent(FinancialAgent):
                                                                      cash), override=True)
     
     # TODO: Record final results for presentation/debugging.  This is probably bad.
-    mytype = str(type(self)).split('.')[-1].split("'")[0]
+    mytype = type(self).__name__
 
     if mytype in self.kernel.meanResultByAgentType:
       self.kernel.meanResultByAgentType[mytype] += cash
@@ -133,75 +167,77 @@ class TradingAgent(FinancialAgent):
     # Do we know the market hours?
     had_mkt_hours = self.mkt_open is not None and self.mkt_close is not None
 
-    # Record market open or close times.
-    if msg.body['msg'] == "WHEN_MKT_OPEN":
-      self.mkt_open = msg.body['data']
+    # Dispatch on the message type.  Unknown types are ignored here, as
+    # subclasses may handle them.
+    body = msg.body
+    handler = self.msg_handlers.get(body['msg'])
+    if handler is not None: handler(body)
 
-      print ("Recorded market open: {}".format(self.kernel.fmtTime(self.mkt_open)))
+    # Once we know the market open and close times, schedule a wakeup call for market open.
+    # Only do this once, when we first have both items.
+    if not had_mkt_hours and self.mkt_open is not None and self.mkt_close is not None:
+      # Agents are asked to generate a wake offset from the market open time.  We structure
+      # this as a subclass request so each agent can supply an appropriate offset relative
+      # to its trading frequency.
+      ns_offset = self.getWakeFrequency()
 
-    elif msg.body['msg'] == "WHEN_MKT_CLOSE":
-      self.mkt_close = msg.body['data']
+      self.setWakeup(self.mkt_open + ns_offset)
 
-      print ("Recorded market close: {}".format(self.kernel.fmtTime(self.mkt_close)))
 
-    elif msg.body['msg'] == "ORDER_EXECUTED":
-      # Call the orderExecuted method, which subclasses should extend.  This parent
-      # class could implement default "portfolio tracking" or "returns tracking"
-      # behavior.
-      order = msg.body['order']
+  # Handlers for each message type, called by receiveMessage() with the message body.
 
-      self.orderExecuted(order)
+  def handleMktOpen (self, body):
+    # Record market open time.
+    self.mkt_open = body['data']
+    self.mkt_open_ns = self.mkt_open.value
 
-    elif msg.body['msg'] == "ORDER_ACCEPTED":
-      # Call the orderAccepted method, which subclasses should extend.
-      order = msg.body['order']
+    print ("Recorded market open: {}".format(self.mkt_open))
 
-      self.orderAccepted(order)
 
-    elif msg.body['msg'] == "ORDER_CANCELLED":
-      # Call the orderCancelled method, which subclasses should extend.
-      order = msg.body['order']
+  def handleMktClose (self, body):
+    # Record market close time.
+    self.mkt_close = body['data']
+    self.mkt_close_ns = self.mkt_close.value
 
-      self.orderCancelled(order)
+    print ("Recorded market close: {}".format(self.mkt_close))
 
-    elif msg.body['msg'] == "MKT_CLOSED":
-      # We've tried to ask the exchange for something after it closed.  Remember this
-      # so we stop asking for things that can't happen.
 
-      self.marketClosed()
+  def handleOrderExecuted (self, body):
+    # An execution notice lists all of this agent's fills from one incoming order.
+    # Call the orderExecuted method, which subclasses may extend, for each fill.
+    for order in body['orders']:
+      self.orderExecuted(order)
 
-    elif msg.body['msg'] == 'QUERY_LAST_TRADE':
-      # Call the queryLastTrade method, which subclasses may extend.
-      # Also note if the market is closed.
-      if msg.body['mkt_closed']: self.mkt_closed = True
 
-      self.queryLastTrade(msg.body['symbol'], msg.body['data'])
+  def handleLastTrade (self, body):
+    # Call the queryLastTrade method, which subclasses may extend.
+    # Also note if the market is closed.
+    if body['mkt_closed']: self.mkt_closed = True
 
-    elif msg.body['msg'] == 'QUERY_SPREAD':
-      # Call the querySpread method, which subclasses may extend.
-      if msg.body['mkt_closed']: self.mkt_closed = True
+    self.queryLastTrade(body['symbol'], body['data'])
 
-      self.querySpread(msg.body['symbol'], msg.body['data'], msg.body['bids'], msg.body['asks'], msg.body['book'])
 
-    elif msg.body['msg'] == 'QUERY_ORDER_STREAM':
-      # Call the queryOrderStream method, which subclasses may extend.
-      if msg.body['mkt_closed']: self.mkt_closed = True
+  def handleSpread (self, body):
+    # Call the querySpread method, which subclasses may extend.
+    if body['mkt_closed']: self.mkt_closed = True
 
-      self.queryOrderStream(msg.body['symbol'], msg.body['orders'])
+    # The exchange also reports the total volume on each side of the reported depth
+    # (if it does not, they are summed here).  These are kept on the agent rather
+    # than passed in, so querySpread overrides keep the same signature.
+    bid_vol_total = body.get('bid_vol_total')
+    ask_vol_total = body.get('ask_vol_total')
+    if bid_vol_total is None: bid_vol_total = sum(qty for _, qty in body['bids'])
+    if ask_vol_total is None: ask_vol_total = sum(qty for _, qty in body['asks'])
+    self.known_vol_totals[body['symbol']] = (bid_vol_total, ask_vol_total)
 
+    self.querySpread(body['symbol'], body['data'], body['bids'], body['asks'], body['book'])
 
-    # Now do we know the market hours?
-    have_mkt_hours = self.mkt_open is not None and self.mkt_close is not None
 
-    # Once we know the market open and close times, schedule a wakeup call for market open.
-    # Only do this once, when we first have both items.
-    if have_mkt_hours and not had_mkt_hours:
-      # Agents are asked to generate a wake offset from the market open time.  We structure
-      # this as a subclass request so each agent can supply an appropriate offset relative
-      # to its trading frequency.
-      ns_offset = self.getWakeFrequency()
+  def handleOrderStream (self, body):
+    # Call the queryOrderStream method, which subclasses may extend.
+    if body['mkt_closed']: self.mkt_closed = True
 
-      self.setWakeup(self.mkt_open + ns_offset)
+    self.queryOrderStream(body['symbol'], body['orders'])
 
 
   # Used by any Trading Agent subclass to query the last trade price for a symbol.
@@ -230,23 +266,26 @@ class TradingAgent(FinancialAgent):
 
     if quantity > 0:
       # Test if this order can be permitted given our at-risk limits.
-      new_holdings = self.holdings.copy()
-
       q = order.quantity if order.is_buy_order else -order.quantity
 
-      if order.symbol in new_holdings: new_holdings[order.symbol] += q
-      else: new_holdings[order.symbol] = q
-
-      # Compute before and after at-risk capital.
-      at_risk = self.markToMarket(self.holdings) - self.holdings['CASH']
-      new_at_risk = self.markToMarket(new_holdings) - new_holdings['CASH']
+      # Compute before and after at-risk capital.  At-risk capital is the marked
+      # value of the non-CASH holdings, so filling this order would change it by
+      # exactly q * last_trade[symbol].  (The offsetting change in CASH is not
+      # at risk, and so does not enter.)  This avoids copying and re-marking
+      # the holdings.
+      at_risk = self.cached_at_risk
+      if at_risk is None:
+        at_risk = self.markToMarket(self.holdings, use_log = False) - self.holdings['CASH']
+        self.cached_at_risk = at_risk
+      new_at_risk = at_risk + q * self.last_trade[order.symbol]
 
       # If at_risk is lower, always allow.  Otherwise, new_at_risk must be below starting cash.
       if (new_at_risk > at_risk) and (new_at_risk > self.startingCash):
-        print ("TradingAgent ignored limit order due to at-risk constraints: {}\n{}".format(order, self.fmtHoldings(self.holdings)))
+        if not util.silent_mode:
+          print ("TradingAgent ignored limit order due to at-risk constraints: {}\n{}".format(order, self.fmtHoldings(self.holdings)))
         return
 
-      self.orders[order.order_id] = deepcopy(order)
+      self.orders[order.order_id] = order.clone()
       self.sendMessage(self.exchangeID, Message({ "msg" : "LIMIT_ORDER", "sender": self.id,
                                                   "order" : order })) 
 
@@ -266,15 +305,17 @@ class TradingAgent(FinancialAgent):
     self.logEvent('CANCEL_SUBMITTED', order)
 
 
-  # Handles ORDER_EXECUTED messages from an exchange agent.  Subclasses may wish to extend,
+  # Handles one execution (fill) reported by an exchange agent.  Subclasses may wish to extend,
   # but should still call parent method for basic portfolio/returns tracking.
   def orderExecuted (self, order):
-    print ("Received notification of execution for: {}".format(order))
+    if not util.silent_mode:
+      print ("Received notification of execution for: {}".format(order))
 
     # Log this activity.
     self.logEvent('ORDER_EXECUTED', order)
 
     # At the very least, we must update CASH and holdings at execution time.
+    self.cached_at_risk = None
     qty = order.quantity if order.is_buy_order else -1 * order.quantity
     sym = order.symbol
 
@@ -298,10 +339,11 @@ class TradingAgent(FinancialAgent):
       if order.quantity >= o.quantity: del self.orders[order.order_id]
       else: o.quantity -= order.quantity
 
-    else:
+    elif not util.silent_mode:
       print ("Execution received for order not in orders list: {}".format(order))
 
-    print ("After execution, agent open orders: {}".format(self.orders))
+    if not util.silent_mode:
+      print ("After execution, agent open orders: {}".format(self.orders))
 
     # After execution, log holdings.
     #self.logEvent('HOLDINGS_UPDATED', self.fmtHoldings(self.holdings))
@@ -310,7 +352,8 @@ class TradingAgent(FinancialAgent):
 
   # Handles ORDER_ACCEPTED messages from an exchange agent.  Subclasses may wish to extend.
   def orderAccepted (self, order):
-    print ("Received notification of acceptance for: {}".format(order))
+    if not util.silent_mode:
+      print ("Received notification of acceptance for: {}".format(order))
 
     # Log this activity.
     self.logEvent('ORDER_ACCEPTED', order)
@@ -321,7 +364,8 @@ class TradingAgent(FinancialAgent):
 
   # Handles ORDER_CANCELLED messages from an exchange agent.  Subclasses may wish to extend.
   def orderCancelled (self, order):
-    print ("Received notification of cancellation for: {}".format(order))
+    if not util.silent_mode:
+      print ("Received notification of cancellation for: {}".format(order))
 
     # Log this activity.
     self.logEvent('ORDER_CANCELLED', order)
@@ -331,13 +375,14 @@ class TradingAgent(FinancialAgent):
     # course they can just override this method.
     if order.order_id in self.orders:
       del self.orders[order.order_id]
-    else:
+    elif not util.silent_mode:
       print ("Cancellation received for order not in orders list: {}".format(order))
 
 
   # Handles MKT_CLOSED messages from an exchange agent.  Subclasses may wish to extend.
   def marketClosed (self):
-    print ("Received notification of market closure.")
+    if not util.silent_mode:
+      print ("Received notification of market closure.")
 
     # Log this activity.
     self.logEvent('MKT_CLOSED')
@@ -349,14 +394,17 @@ class TradingAgent(FinancialAgent):
   # Handles QUERY_LAST_TRADE messages from an exchange agent.
   def queryLastTrade (self, symbol, price):
     self.last_trade[symbol] = price
+    self.cached_at_risk = None
 
-    print ("Received last trade price of {} for {}.".format(self.last_trade[symbol], symbol))
+    if not util.silent_mode:
+      print ("Received last trade price of {} for {}.".format(self.last_trade[symbol], symbol))
 
     if self.mkt_closed:
       # Note this as the final price of the day.
       self.daily_close_price[symbol] = self.last_trade[symbol]
 
-      print ("Received daily close price of {} for {}.".format(self.last_trade[symbol], symbol))
+      if not util.silent_mode:
+        print ("Received daily close price of {} for {}.".format(self.last_trade[symbol], symbol))
 
 
   # Handles QUERY_SPREAD messages from an exchange agent.
@@ -367,17 +415,15 @@ class TradingAgent(FinancialAgent):
     self.known_bids[symbol] = bids
     self.known_asks[symbol] = asks
 
-    if bids: best_bid, best_bid_qty = (bids[0][0], bids[0][1])
-    else: best_bid, best_bid_qty = ('No bids', 0)
+    if not util.silent_mode:
+      best_bid, best_bid_qty = bids[0] if bids else ('No bids', 0)
+      best_ask, best_ask_qty = asks[0] if asks else ('No asks', 0)
 
-    if asks: best_ask, best_ask_qty = (asks[0][0], asks[0][1])
-    else: best_ask, best_ask_qty = ('No asks', 0)
-
-    print ("Received spread of {} @ {} / {} @ {} for {}".format(best_bid_qty, best_bid, best_ask_qty, best_ask, symbol))
+      print ("Received spread of {} @ {} / {} @ {} for {}".format(best_bid_qty, best_bid, best_ask_qty, best_ask, symbol))
 
     self.logEvent("BID_DEPTH", bids)
     self.logEvent("ASK_DEPTH", asks)
-    self.logEvent("IMBALANCE", [sum([x[1] for x in bids]), sum([x[1] for x in asks])])
+    self.logEvent("IMBALANCE", list(self.known_vol_totals[symbol]))
 
     self.book = book
 
@@ -397,11 +443,11 @@ class TradingAgent(FinancialAgent):
 
   # Extract the current known best bid and ask.  This does NOT request new information.
   def getKnownBidAsk (self, symbol) :
-    bid = self.known_bids[symbol][0][0] if self.known_bids[symbol] else None
-    ask = self.known_asks[symbol][0][0] if self.known_asks[symbol] else None
+    bids = self.known_bids[symbol]
+    asks = self.known_asks[symbol]
 
-    bid_vol = self.known_bids[symbol][0][1] if self.known_bids[symbol] else 0
-    ask_vol = self.known_asks[symbol][0][1] if self.known_asks[symbol] else 0
+    bid, bid_vol = bids[0] if bids else (None, 0)
+    ask, ask_vol = asks[0] if asks else (None, 0)
 
     return bid, bid_vol, ask, ask_vol
 
@@ -418,42 +464,50 @@ class TradingAgent(FinancialAgent):
     bid_liq = self.getBookLiquidity(self.known_bids[symbol], within)
     ask_liq = self.getBookLiquidity(self.known_asks[symbol], within)
 
-    print ("Bid/ask liq: {}, {}".format(bid_liq, ask_liq))
-    print ("Known bids: {}".format(self.known_bids[self.symbol]))
-    print ("Known asks: {}".format(self.known_asks[self.symbol]))
+    if not util.silent_mode:
+      print ("Bid/ask liq: {}, {}".format(bid_liq, ask_liq))
+      print ("Known bids: {}".format(self.known_bids[self.symbol]))
+      print ("Known asks: {}".format(self.known_asks[self.symbol]))
 
     return bid_liq, ask_liq
 
 
   # Helper function for the above.  Checks one side of the known order book.
   def getBookLiquidity (self, book, within):
-    liq = 0
-    for i, (price, shares) in enumerate(book):
-      if i == 0:
-        best = price
+    if not book: return 0
 
+    best = book[0][0]
+    tolerance = int(round(best * within))
+
+    liq = 0
+    for price, shares in book:
       # Is this price within "within" proportion of the best price?
-      if abs(best - price) <= int(round(best * within)):
-        print ("Within {} of {}: {} with {} shares".format(within, best, price, shares))
+      if abs(best - price) <= tolerance:
+        if not util.silent_mode:
+          print ("Within {} of {}: {} with {} shares".format(within, best, price, shares))
         liq += shares
 
     return liq
 
 
-  # Marks holdings to market (including cash).
-  def markToMarket (self, holdings):
+  # Marks holdings to market (including cash).  Logs the result unless use_log is False,
+  # as for the at-risk check on each order placed.
+  def markToMarket (self, holdings, use_log = True):
     cash = holdings['CASH']
 
+    last_trade = self.last_trade
+
     for symbol, shares in holdings.items():
       if symbol == 'CASH': continue
 
-      value = self.last_trade[symbol] * shares
+      value = last_trade[symbol] * shares
       cash += value
 
-      self.logEvent('MARK_TO_MARKET', "{} {} @ {} == {}".format(shares, symbol,
-                    self.last_trade[symbol], value))
+      if use_log and self.log_mtm_detail:
+        self.logEvent('MARK_TO_MARKET', "{} {} @ {} == {}".format(shares, symbol,
+                      last_trade[symbol], value))
 
-    self.logEvent('MARKED_TO_MARKET', cash)
+    if use_log: self.logEvent('MARKED_TO_MARKET', cash)
 
     return cash
 
@@ -1,5 +1,6 @@
 from agent.TradingAgent import TradingAgent
 from message.Message import Message
+from util import util
 from util.util import print
 
 from math import sqrt
@@ -7,6 +8,10 @@ import numpy as np
 import pandas as pd
 import sys
 
+# Number of random values drawn at a time for each of the agent's per-wakeup
+# draws (see drawWakeInterval() and friends).
+RANDOM_BLOCK = 1024
+
 class ZeroIntelligenceAgent(TradingAgent):
 
   def __init__(self, id, name, symbol, startingCash=100000, sigma_n=1000, 
@@ -30,6 +35,10 @@ class ZeroIntelligenceAgent(TradingAgent):
     self.eta = eta
     self.lambda_a = lambda_a
 
+    # Constants of the mean reversion used by every estimate update.
+    self.one_m_kappa = 1.0 - kappa
+    self.one_m_kappa2_denom = 1.0 - self.one_m_kappa ** 2
+
     # The agent uses this to track whether it has begun its strategy or is still
     # handling pre-market tasks.
     self.trading = False
@@ -42,14 +51,22 @@ class ZeroIntelligenceAgent(TradingAgent):
     self.r_t = r_bar
     self.sigma_t = 0
 
-    # The agent must track its previous wake time, so it knows how many time
-    # units have passed.
-    self.prev_wake_time = None
+    # The agent must track its previous wake time (int ns), so it knows how many
+    # time units have passed.
+    self.prev_wake_ns = None
+
+    # The agent has a private value for each incremental unit, in descending order.
+    self.theta = np.sort(np.round(np.random.normal(loc=0, scale=sqrt(sigma_pv),
+                                                   size=(q_max*2))).astype(np.int64))[::-1].copy()
 
-    # The agent has a private value for each incremental unit.
-    self.theta = [int(x) for x in sorted(
-                  np.round(np.random.normal(loc=0, scale=sqrt(sigma_pv), size=(q_max*2))).tolist(),
-                  reverse=True)]
+    # The agent makes its frequent random draws (wake intervals, coin flips,
+    # requested surplus) from its own random state, a block at a time, as one
+    # large draw is much cheaper than many single draws.  The state is seeded
+    # from the global RNG so runs remain reproducible from the config's seed.
+    self.random_state = np.random.RandomState(seed=np.random.randint(low=0, high=2**31-1))
+    self.wake_intervals = []
+    self.coin_flips = []
+    self.surpluses = []
 
 
   def kernelStarting(self, startTime):
@@ -95,8 +112,8 @@ class ZeroIntelligenceAgent(TradingAgent):
     # each agent independently sampling its next arrival time from an exponential
     # distribution in alternate Beta formation with Beta = 1 / lambda, where lambda
     # is the mean arrival rate of the Poisson process.
-    delta_time = np.random.exponential(scale = 1.0 / self.lambda_a)
-    self.setWakeup(currentTime + pd.Timedelta('{}ns'.format(int(round(delta_time)))))
+    delta_time = self.drawWakeInterval()
+    self.setWakeup(currentTime + np.timedelta64(int(round(delta_time)), 'ns'))
  
 
     # If the market has closed and we haven't obtained the daily close price yet,
@@ -139,7 +156,8 @@ class ZeroIntelligenceAgent(TradingAgent):
     # and uses this to update its internal estimates in a Bayesian manner.
     obs_t = self.oracle.observePrice(self.symbol, self.currentTime, sigma_n = self.sigma_n)
 
-    print ("{} observed {} at {}".format(self.name, obs_t, self.currentTime))
+    if not util.silent_mode:
+      print ("{} observed {} at {}".format(self.name, obs_t, self.currentTime))
 
 
     # Flip a coin to decide if we will buy or sell a unit at this time.
@@ -147,66 +165,51 @@ class ZeroIntelligenceAgent(TradingAgent):
 
     if q >= self.q_max:
       buy = False
-      print ("Long holdings limit: agent will SELL")
+      if not util.silent_mode:
+        print ("Long holdings limit: agent will SELL")
     elif q <= -self.q_max:
       buy = True
-      print ("Short holdings limit: agent will BUY")
+      if not util.silent_mode:
+        print ("Short holdings limit: agent will BUY")
     else:
-      buy = bool(np.random.randint(0,2))
-      print ("Coin flip: agent will {}".format("BUY" if buy else "SELL"))
+      buy = self.drawCoinFlip()
+      if not util.silent_mode:
+        print ("Coin flip: agent will {}".format("BUY" if buy else "SELL"))
 
 
     # Update internal estimates of the current fundamental value and our error of same.
 
     # If this is our first estimate, treat the previous wake time as "market open".
-    if self.prev_wake_time is None: self.prev_wake_time = self.mkt_open
-
-    # First, obtain an intermediate estimate of the fundamental value by advancing
-    # time from the previous wake time to the current time, performing mean
-    # reversion at each time step.
-
-    # delta must be integer time steps since last wake
-    delta = (self.currentTime - self.prev_wake_time) / np.timedelta64(1, 'ns')
-
-    # Update r estimate for time advancement.
-    r_tprime  = (1 - (1 - self.kappa) ** delta) * self.r_bar
-    r_tprime += ((1 - self.kappa) ** delta) * self.r_t
-
-    # Update sigma estimate for time advancement.
-    sigma_tprime  = ((1 - self.kappa) ** (2*delta)) * self.sigma_t
-    sigma_tprime += ((1 - (1 - self.kappa)**(2*delta)) / (1 - (1 - self.kappa)**2)) * self.sigma_s
-
-    # Apply the new observation, with "confidence" in the observation inversely proportional
-    # to the observation noise, and "confidence" in the previous estimate inversely proportional
-    # to the shock variance.
-    self.r_t  = (self.sigma_n / (self.sigma_n + sigma_tprime)) * r_tprime
-    self.r_t += (sigma_tprime / (self.sigma_n + sigma_tprime)) * obs_t
-
-    self.sigma_t = (self.sigma_n * self.sigma_t) / (self.sigma_n + self.sigma_t)
+    if self.prev_wake_ns is None: self.prev_wake_ns = self.mkt_open_ns
 
-    # Now having a best estimate of the fundamental at time t, we can make our best estimate
-    # of the final fundamental (for time T) as of current time t.  Delta is now the number
+    # delta_t must be integer time steps since last wake, and delta_T is the number
     # of time steps remaining until the simulated exchange closes.
-    delta = (self.mkt_close - self.currentTime) / np.timedelta64(1, 'ns')
-    r_T  = (1 - (1 - self.kappa) ** delta) * self.r_bar
-    r_T += ((1 - self.kappa) ** delta) * r_tprime
+    current_ns = self.currentTime.value
+    delta_t = current_ns - self.prev_wake_ns
+    delta_T = self.mkt_close_ns - current_ns
+
+    self.r_t, self.sigma_t, r_T = updateEstimate(self.one_m_kappa, self.one_m_kappa2_denom, self.r_bar,
+                                                 self.r_t, self.sigma_t, self.sigma_s, self.sigma_n,
+                                                 obs_t, delta_t, delta_T)
 
     # Our final fundamental estimate should be quantized to whole units of value.
     r_T = int(round(r_T))
 
     # Finally (for the final fundamental estimation section) remember the current
     # time as the previous wake time.
-    self.prev_wake_time = self.currentTime
+    self.prev_wake_ns = current_ns
 
-    print ("{} estimates r_T = {} as of {}".format(self.name, r_T, self.currentTime))
+    if not util.silent_mode:
+      print ("{} estimates r_T = {} as of {}".format(self.name, r_T, self.currentTime))
 
 
     # Determine the agent's total valuation.
     q += (self.q_max - 1)
-    theta = self.theta[q+1 if buy else q]
+    theta = int(self.theta[q+1 if buy else q])
     v = r_T + theta
 
-    print ("{} total unit valuation is {} (theta = {})".format(self.name, v, theta))
+    if not util.silent_mode:
+      print ("{} total unit valuation is {} (theta = {})".format(self.name, v, theta))
 
 
     # Return values needed to implement strategy and select limit price.
@@ -222,7 +225,7 @@ class ZeroIntelligenceAgent(TradingAgent):
 
 
     # Select a requested surplus for this trade.
-    R = np.random.randint(self.R_min, self.R_max+1)
+    R = self.drawSurplus()
 
 
     # Determine the limit price.
@@ -235,16 +238,18 @@ class ZeroIntelligenceAgent(TradingAgent):
     if buy and ask_vol > 0:
       R_ask = v - ask
       if R_ask >= (self.eta * R):
-        print ("{} desired R = {}, but took R = {} at ask = {} due to eta".format(self.name, R, R_ask, ask))
+        if not util.silent_mode:
+          print ("{} desired R = {}, but took R = {} at ask = {} due to eta".format(self.name, R, R_ask, ask))
         p = ask
-      else:
+      elif not util.silent_mode:
         print ("{} demands R = {}, limit price {}".format(self.name, R, p))
     elif (not buy) and bid_vol > 0:
       R_bid = bid - v
       if R_bid >= (self.eta * R):
-        print ("{} desired R = {}, but took R = {} at bid = {} due to eta".format(self.name, R, R_bid, bid))
+        if not util.silent_mode:
+          print ("{} desired R = {}, but took R = {} at bid = {} due to eta".format(self.name, R, R_bid, bid))
         p = bid
-      else:
+      elif not util.silent_mode:
         print ("{} demands R = {}, limit price {}".format(self.name, R, p))
       
 
@@ -286,7 +291,9 @@ class ZeroIntelligenceAgent(TradingAgent):
   def cancelOrders (self):
     if not self.orders: return False
 
-    for id, order in self.orders.items():
+    # cancelOrder() does not modify self.orders (that happens when the exchange
+    # confirms), so it is safe to iterate the open orders directly.
+    for order in self.orders.values():
       self.cancelOrder(order)
 
     return True
@@ -298,6 +305,76 @@ class ZeroIntelligenceAgent(TradingAgent):
            (len(self.holdings) == 1 and 'CASH' not in self.holdings)
 
 
+  # Random draws.  Each returns the next value from a pre-drawn block, drawing a
+  # new block of RANDOM_BLOCK values when the current one runs out.
+
+  # Time until the next arrival (ns, float) of the agent's Poisson process.
+  def drawWakeInterval (self):
+    if not self.wake_intervals:
+      self.wake_intervals = self.random_state.exponential(scale = 1.0 / self.lambda_a,
+                                                          size = RANDOM_BLOCK).tolist()
+    return self.wake_intervals.pop()
+
+
+  # True (buy) or False (sell), with equal probability.
+  def drawCoinFlip (self):
+    if not self.coin_flips:
+      self.coin_flips = (self.random_state.randint(0, 2, size = RANDOM_BLOCK) == 1).tolist()
+    return self.coin_flips.pop()
+
+
+  # Requested surplus R, uniform over [R_min, R_max].
+  def drawSurplus (self):
+    if not self.surpluses:
+      self.surpluses = self.random_state.randint(self.R_min, self.R_max+1, size = RANDOM_BLOCK).tolist()
+    return self.surpluses.pop()
+
+
   def getWakeFrequency (self):
     return pd.Timedelta(np.random.randint(low = 0, high = 100), unit='ns')
 
+
+# Bayesian update of a ZI agent's estimates of the mean-reverting fundamental.
+# All arguments are plain numbers, and the function has no side effects.
+# one_m_kappa is (1 - kappa) and one_m_kappa2_denom is (1 - (1 - kappa)**2).
+# Returns the new r_t and sigma_t, and the estimate of the final fundamental
+# r_T (unrounded).  Defined outside the class so the arithmetic does not pay
+# for attribute lookups, and so it could be compiled separately if needed.
+# (It takes and returns only floats and ints, so the same signature would
+# work for a Cython or Numba version.  The project has no build step for
+# extensions, so none is provided.)
+#
+# Updates are not batched across agents.  Each runs when that agent's own
+# QUERY_SPREAD response arrives, after an exchange round trip and the random
+# latency noise, so agents almost never update at the same kernel time.  Each
+# agent's oracle observation also comes, in event order, from the oracle's
+# pooled draws on the shared RNG stream.  (Coin flips and other agent draws use
+# the agent's own random_state.)
+def updateEstimate (one_m_kappa, one_m_kappa2_denom, r_bar, r_t, sigma_t, sigma_s, sigma_n,
+                    obs_t, delta_t, delta_T):
+  # First, obtain an intermediate estimate of the fundamental value by advancing
+  # time from the previous wake time to the current time, performing mean
+  # reversion at each time step.
+
+  # Update r estimate for time advancement.
+  decay = one_m_kappa ** delta_t
+  r_tprime = (1 - decay) * r_bar + decay * r_t
+
+  # Update sigma estimate for time advancement.
+  decay2 = decay * decay
+  sigma_tprime = decay2 * sigma_t + ((1 - decay2) / one_m_kappa2_denom) * sigma_s
+
+  # Apply the new observation, with "confidence" in the observation inversely proportional
+  # to the observation noise, and "confidence" in the previous estimate inversely proportional
+  # to the shock variance.
+  new_r_t  = (sigma_n / (sigma_n + sigma_tprime)) * r_tprime
+  new_r_t += (sigma_tprime / (sigma_n + sigma_tprime)) * obs_t
+
+  new_sigma_t = (sigma_n * sigma_t) / (sigma_n + sigma_t)
+
+  # Now having a best estimate of the fundamental at time t, we can make our best estimate
+  # of the final fundamental (for time T) as of current time t.
+  decay_T = one_m_kappa ** delta_T
+  r_T = (1 - decay_T) * r_bar + decay_T * r_tprime
+
+  return new_r_t, new_sigma_t, r_T
@@ -11,6 +11,10 @@ class MessageType(Enum):
 
 class Message:
 
+  # Messages are created for nearly every kernel event, so avoid a per-instance
+  # __dict__.  Subclasses may still add attributes (and so a __dict__) if needed.
+  __slots__ = ('body',)
+
   def __init__ (self, body = None):
     # The base Message class no longer holds envelope/header information,
     # however any desired information can be placed in the arbitrary
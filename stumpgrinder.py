@@ -1,5 +1,6 @@
 import argparse
 import importlib
+import logging
 import sys
 
 if __name__ == '__main__':
@@ -23,6 +24,11 @@ if __name__ == '__main__':
 
   args, config_args = parser.parse_known_args()
 
+  # Kernel per-event output is logged at DEBUG.  Send it to stdout, unadorned, like
+  # the rest of the simulation output.  (The Kernel also suppresses it in silent mode.)
+  logging.basicConfig(stream=sys.stdout, format='%(message)s')
+  logging.getLogger('Kernel').setLevel(logging.DEBUG)
+
   # First parameter supplied is config file.
   config_file = args.config
 
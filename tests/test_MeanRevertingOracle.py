@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+
+from util.oracle.MeanRevertingOracle import mean_reverting_series
+
+
+# The step-by-step recursion that mean_reverting_series() evaluates in closed form.
+def step_series (r_bar, kappa, shock):
+  r = np.empty(shock.shape[0])
+  r[0] = r_bar
+  for t in range(1, shock.shape[0]):
+    r[t] = max(0, (kappa * r_bar) + ((1 - kappa) * r[t-1]) + shock[t])
+  return r
+
+
+class TestMeanRevertingSeries(unittest.TestCase):
+
+  def check (self, r_bar, kappa, sigma_s, n = 5000, seed = 1):
+    shock = np.random.RandomState(seed).normal(scale=sigma_s, size=n)
+    expected = step_series(r_bar, kappa, shock)
+    actual = mean_reverting_series(r_bar, kappa, shock)
+    np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-6)
+
+  def test_matches_step_recursion (self):
+    for kappa in [0, 0.3, 1, 1.5]:
+      with self.subTest(kappa=kappa):
+        self.check(100000, kappa, 100)
+
+  def test_matches_step_recursion_with_clipping (self):
+    # Shocks large enough relative to r_bar that the series often clips at zero.
+    for kappa in [0, 0.3, 1, 1.5]:
+      with self.subTest(kappa=kappa):
+        self.check(100, kappa, 200)
+
+  def test_fast_reversion_spans_several_blocks (self):
+    # alpha = +/-0.4 limits blocks to a few hundred steps, so the series is built
+    # from many blocks, each continuing from the last.
+    for kappa in [0.6, 1.4]:
+      with self.subTest(kappa=kappa):
+        self.check(100000, kappa, 100, n=20000)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+import pandas as pd
+
+from util import util
+from util.OrderBook import OrderBook
+from util.order.LimitOrder import LimitOrder
+
+
+# Stands in for the ExchangeAgent that owns an OrderBook, recording what it sends.
+class FakeExchange:
+
+  def __init__ (self):
+    self.currentTime = pd.Timestamp('2019-06-28 09:30')
+    self.stream_history = 10
+    self.sent = []
+
+  def sendMessage (self, recipientID, msg):
+    self.sent.append((recipientID, msg.body))
+
+  def logEvent (self, eventType, event = ''):
+    pass
+
+
+class TestOrderBookSweep(unittest.TestCase):
+
+  def setUp (self):
+    util.silent_mode = True
+    self.owner = FakeExchange()
+    self.book = OrderBook(self.owner, 'IBM')
+
+  def test_sweep_sends_one_execution_notice_per_agent (self):
+    # Agent 2 rests two asks at different prices.  Agent 1's bid sweeps both.
+    asks = [ LimitOrder(2, self.owner.currentTime, 'IBM', 3, False, 10000),
+             LimitOrder(2, self.owner.currentTime, 'IBM', 2, False, 10001) ]
+    for ask in asks: self.book.handleLimitOrder(ask)
+    self.owner.sent = []
+
+    bid = LimitOrder(1, self.owner.currentTime, 'IBM', 5, True, 10001)
+    self.book.handleLimitOrder(bid)
+
+    executed = [ (agent_id, body) for agent_id, body in self.owner.sent
+                 if body['msg'] == 'ORDER_EXECUTED' ]
+    self.assertEqual([ agent_id for agent_id, _ in executed ], [1, 2])
+
+    buyer_fills = executed[0][1]['orders']
+    self.assertEqual([ (o.quantity, o.fill_price) for o in buyer_fills ], [ (3, 10000), (2, 10001) ])
+    self.assertTrue(all(o.order_id == bid.order_id for o in buyer_fills))
+
+    seller_fills = executed[1][1]['orders']
+    self.assertEqual([ o.order_id for o in seller_fills ], [ a.order_id for a in asks ])
+
+    # Nothing is left on either side, and the bid was fully filled rather than accepted.
+    self.assertEqual(self.book.bids, [])
+    self.assertEqual(self.book.asks, [])
+    self.assertFalse(any(body['msg'] == 'ORDER_ACCEPTED' for _, body in self.owner.sent))
+
+  def test_sweep_records_every_fill_in_history (self):
+    asks = [ LimitOrder(2, self.owner.currentTime, 'IBM', 1, False, 10000 + i) for i in range(3) ]
+    for ask in asks: self.book.handleLimitOrder(ask)
+
+    bid = LimitOrder(1, self.owner.currentTime, 'IBM', 3, True, 10002)
+    self.book.handleLimitOrder(bid)
+
+    entry = [ h[bid.order_id] for h in self.book.history if bid.order_id in h ]
+    self.assertEqual(len(entry), 1)
+    self.assertEqual(len(entry[0]['transactions']), 3)
+
+  def test_single_fill_notice_keeps_order_key (self):
+    ask = LimitOrder(2, self.owner.currentTime, 'IBM', 1, False, 10000)
+    self.book.handleLimitOrder(ask)
+    self.owner.sent = []
+
+    self.book.handleLimitOrder(LimitOrder(1, self.owner.currentTime, 'IBM', 1, True, 10000))
+
+    for _, body in self.owner.sent:
+      self.assertEqual(body['msg'], 'ORDER_EXECUTED')
+      self.assertIs(body['order'], body['orders'][0])
+
+
+if __name__ == '__main__':
+  unittest.main()
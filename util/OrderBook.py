@@ -1,15 +1,31 @@
 # Basic class for an order book for one symbol, in the style of the major US Stock Exchanges.
-# List of bid prices (index zero is best bid), each with a list of LimitOrders.
-# List of ask prices (index zero is best ask), each with a list of LimitOrders.
+# List of bid price levels (index zero is best bid), each with a queue of LimitOrders.
+# List of ask price levels (index zero is best ask), each with a queue of LimitOrders.
 import sys
 
+from bisect import bisect_left
+from collections import deque
 from message.Message import Message
 from util.order.LimitOrder import LimitOrder
+from util import util
 from util.util import print
 
-from copy import deepcopy
 from agent.FinancialAgent import dollarize
 
+# One price level on one side of an order book: the price, the LimitOrders at that
+# price (a deque, oldest at index 0, so fills pop from the front cheaply), and their
+# total share quantity.  The OrderBook keeps total_qty current as orders enter,
+# execute, and cancel.
+class PriceLevel:
+
+  __slots__ = ('price', 'orders', 'total_qty')
+
+  def __init__ (self, order):
+    self.price = order.limit_price
+    self.orders = deque([order])
+    self.total_qty = order.quantity
+
+
 class OrderBook:
 
   # An OrderBook requires an owning agent object, which it will use to send messages
@@ -22,9 +38,18 @@ class OrderBook:
     self.asks = []
     self.last_trade = None
 
+    # Index each side's price levels (the same PriceLevels held in self.bids and
+    # self.asks) by price, so an order can find its level without scanning the book.
+    self.bid_levels = {}
+    self.ask_levels = {}
+
+    # Sort keys parallel to self.bids and self.asks, ascending so they can be bisected:
+    # the negated price for bids, and the price itself for asks.
+    self.bid_keys = []
+    self.ask_keys = []
+
     # Create an empty list of dictionaries to log the full order book depth (price and volume) each time it changes.
     self.book_log = []
-    self.quotes_seen = set()
 
     # Create an order history for the exchange to report to certain agent types.
     self.history = [{}]
@@ -33,8 +58,8 @@ class OrderBook:
   def handleLimitOrder (self, order):
     # Matches a limit order or adds it to the order book.  Handles partial matches piecewise,
     # consuming all possible shares at the best price before moving on, without regard to
-    # order size "fit" or minimizing number of transactions.  Sends one notification per
-    # match.
+    # order size "fit" or minimizing number of transactions.  Sends each agent involved
+    # one execution notification listing all of its fills from this order.
     if order.symbol != self.symbol:
       print ("{} order discarded.  Does not match OrderBook symbol: {}".format(order.symbol, self.symbol))
       return
@@ -51,27 +76,37 @@ class OrderBook:
     
     matching = True
 
-    self.prettyPrint()
+    # Building the book printout and the per-order notes below costs far more than
+    # the matching itself, so skip it entirely when output would be discarded.
+    if not util.silent_mode: self.prettyPrint()
 
     executed = []
 
+    # Fills to report, by agent id.  The new order's agent is entered first, so it is
+    # notified before its counterparties, as it was when each match sent its own messages.
+    fills = { order.agent_id : [] }
+    accepted = False
+
     while matching:
-      matched_order = deepcopy(self.executeOrder(order))
+      # executeOrder() returns an order no longer held by the book (either removed
+      # from it, or a partial copy), so it is safe to send without copying.
+      matched_order = self.executeOrder(order)
 
       if matched_order:
         # Decrement quantity on new order and notify traders of execution.
-        filled_order = deepcopy(order)
+        filled_order = order.clone()
         filled_order.quantity = matched_order.quantity
         filled_order.fill_price = matched_order.fill_price
 
         order.quantity -= filled_order.quantity
 
-        print ("MATCHED: new order {} vs old order {}".format(filled_order, matched_order))
-        print ("SENT: notifications of order execution to agents {} and {} for orders {} and {}".format(
-               filled_order.agent_id, matched_order.agent_id, filled_order.order_id, matched_order.order_id))
+        if not util.silent_mode:
+          print ("MATCHED: new order {} vs old order {}".format(filled_order, matched_order))
+          print ("SENT: notifications of order execution to agents {} and {} for orders {} and {}".format(
+                 filled_order.agent_id, matched_order.agent_id, filled_order.order_id, matched_order.order_id))
 
-        self.owner.sendMessage(order.agent_id, Message({ "msg": "ORDER_EXECUTED", "order": filled_order }))
-        self.owner.sendMessage(matched_order.agent_id, Message({ "msg": "ORDER_EXECUTED", "order": matched_order }))
+        fills[order.agent_id].append(filled_order)
+        fills.setdefault(matched_order.agent_id, []).append(matched_order)
 
         # Accumulate the volume and average share price of the currently executing inbound trade.
         executed.append( ( filled_order.quantity, filled_order.fill_price ) )
@@ -81,59 +116,68 @@ class OrderBook:
 
       else:
         # No matching order was found, so the new order enters the order book.  Notify the agent.
-        self.enterOrder(deepcopy(order))
-
-        print ("ACCEPTED: new order {}".format(order))
-        print ("SENT: notifications of order acceptance to agent {} for order {}".format(
-               order.agent_id, order.order_id))
+        self.enterOrder(order.clone())
 
-        self.owner.sendMessage(order.agent_id, Message({ "msg": "ORDER_ACCEPTED", "order": order }))
+        if not util.silent_mode:
+          print ("ACCEPTED: new order {}".format(order))
+          print ("SENT: notifications of order acceptance to agent {} for order {}".format(
+                 order.agent_id, order.order_id))
 
+        accepted = True
         matching = False
 
+    # Notify traders of execution, then of acceptance of any unfilled remainder.  A notice
+    # with a single fill also carries it under 'order', as before fills were batched.
+    for agent_id, orders in fills.items():
+      if len(orders) == 1:
+        self.owner.sendMessage(agent_id, Message({ "msg": "ORDER_EXECUTED", "orders": orders,
+                                                   "order": orders[0] }))
+      elif orders:
+        self.owner.sendMessage(agent_id, Message({ "msg": "ORDER_EXECUTED", "orders": orders }))
+
+    if accepted:
+      self.owner.sendMessage(order.agent_id, Message({ "msg": "ORDER_ACCEPTED", "order": order }))
+
     if not matching:
       # Now that we are done executing or accepting this order, log the new best bid and ask.
       if self.bids:
         self.owner.logEvent('BEST_BID', "{},{},{}".format(self.symbol,
-                                  self.bids[0][0].limit_price,
-                                  sum([o.quantity for o in self.bids[0]])))
+                                  self.bids[0].price,
+                                  self.bids[0].total_qty))
 
       if self.asks:
         self.owner.logEvent('BEST_ASK', "{},{},{}".format(self.symbol,
-                                self.asks[0][0].limit_price,
-                                sum([o.quantity for o in self.asks[0]])))
+                                self.asks[0].price,
+                                self.asks[0].total_qty))
 
       # Also log the last trade (total share quantity, average share price).
       if executed:
         trade_qty = 0
         trade_price = 0
         for q, p in executed:
-          print ("Executed: {} @ {}".format(q, p))
+          if not util.silent_mode: print ("Executed: {} @ {}".format(q, p))
           trade_qty += q
           trade_price += (p*q)
 
         avg_price = int(round(trade_price / trade_qty))
-        print ("Avg: {} @ ${:0.4f}".format(trade_qty, avg_price))
+        if not util.silent_mode: print ("Avg: {} @ ${:0.4f}".format(trade_qty, avg_price))
         self.owner.logEvent('LAST_TRADE', "{},${:0.4f}".format(trade_qty, avg_price))
 
         self.last_trade = avg_price
 
-      # Finally, log the full depth of the order book.
+      # Finally, log the full depth of the order book.  Rows are sparse: quotes
+      # with no volume now are left out, and filled with zero when the log is
+      # turned into a DataFrame at the end of the day.
       row = { 'QuoteTime' : self.owner.currentTime }
-      for quote in self.quotes_seen:
-        row[quote] = 0
       for quote, volume in self.getInsideBids():
         row[quote] = -volume
-        self.quotes_seen.add(quote)
       for quote, volume in self.getInsideAsks():
         if quote in row:
-          if row[quote] != 0:
-            print ("WARNING: THIS IS A REAL PROBLEM: an order book contains bids and asks at the same quote price!", override=True)
+          print ("WARNING: THIS IS A REAL PROBLEM: an order book contains bids and asks at the same quote price!", override=True)
         row[quote] = volume
-        self.quotes_seen.add(quote)
       self.book_log.append(row)
 
-    self.prettyPrint()
+    if not util.silent_mode: self.prettyPrint()
 
 
   def executeOrder (self, order):
@@ -145,77 +189,88 @@ class OrderBook:
     # Track which (if any) existing order was matched with the current order.
     if order.is_buy_order:
       book = self.asks
+      levels = self.ask_levels
+      keys = self.ask_keys
     else:
       book = self.bids
+      levels = self.bid_levels
+      keys = self.bid_keys
 
-    # TODO: Simplify?  It is ever possible to actually select an execution match
-    # other than the best bid or best ask?  We may not need these execute loops.
-
-    # First, examine the correct side of the order book for a match.
+    # First, examine the correct side of the order book for a match.  Only the best
+    # price level can match: any order that would match a deeper level also matches
+    # the best one, and best price is taken first.
     if not book:
       # No orders on this side.
       return None
-    elif not self.isMatch(order, book[0][0]):
+
+    # The test is isMatch() inlined against the level price, since the book side
+    # already guarantees the orders are of opposite type.
+    level = book[0]
+    if order.is_buy_order: crosses = order.limit_price >= level.price
+    else: crosses = order.limit_price <= level.price
+
+    if not crosses:
       # There were orders on the right side, but the prices do not overlap.
       # Or: bid could not match with best ask, or vice versa.
       # Or: bid offer is below the lowest asking price, or vice versa.
       return None
-    else:
-      # There are orders on the right side, and the new order's price does fall
-      # somewhere within them.  Find the best-price matching order.
-
-      # Current matching is best price then FIFO (at same price).
-      # Note that o is a LIST of all orders (oldest at index 0) at this same price.
-      for i, o in enumerate(book):
-        # The first time we find an order that can match, we take it.
-        if self.isMatch(order, o[0]):
-          # The matched order might be only partially filled.
-          # (i.e. new order is smaller)
-          if order.quantity >= o[0].quantity:
-            # Consumed entire matched order.
-            matched_order = book[i].pop(0)
 
-            # If the matched price now has no orders, remove it completely.
-            if not book[i]:
-              del book[i]
+    # Current matching is best price then FIFO (at same price).
+    # Note that level holds all orders (oldest at index 0) at the best price.
+    # The matched order might be only partially filled.
+    # (i.e. new order is smaller)
+    if order.quantity >= level.orders[0].quantity:
+      # Consumed entire matched order.
+      matched_order = level.orders.popleft()
+      level.total_qty -= matched_order.quantity
+
+      # If the matched price now has no orders, remove it completely.
+      if not level.orders:
+        del book[0]
+        del keys[0]
+        del levels[level.price]
 
-          else:
-            # Consumed only part of matched order.
-            matched_order = deepcopy(book[i][0])
-            matched_order.quantity = order.quantity
+    else:
+      # Consumed only part of matched order.
+      matched_order = level.orders[0].clone()
+      matched_order.quantity = order.quantity
 
-            book[i][0].quantity -= matched_order.quantity
+      level.orders[0].quantity -= matched_order.quantity
+      level.total_qty -= matched_order.quantity
 
-          # When two limit orders are matched, they execute at the price that
-          # was being "advertised" in the order book.
-          matched_order.fill_price = matched_order.limit_price
+    # When two limit orders are matched, they execute at the price that
+    # was being "advertised" in the order book.
+    matched_order.fill_price = matched_order.limit_price
 
-          # Record the transaction in the order history and push the indices
-          # out one, possibly truncating to the maximum history length.
+    # Record the transaction in the order history and push the indices
+    # out one, possibly truncating to the maximum history length.
 
-          # The incoming order is guaranteed to exist under index 0.
-          self.history[0][order.order_id]['transactions'].append( (self.owner.currentTime, order.quantity) )
+    # The incoming order was entered under index 0, but each earlier fill of the same
+    # order has since pushed it out one index (or off the end of the history).
+    for idx, orders in enumerate(self.history):
+      if order.order_id not in orders: continue
 
-          # The pre-existing order may or may not still be in the recent history.
-          for idx, orders in enumerate(self.history):
-            if matched_order.order_id not in orders: continue
+      # Found the incoming order in history.  Update it with this transaction.
+      orders[order.order_id]['transactions'].append( (self.owner.currentTime, order.quantity) )
+      break
 
-            # Found the matched order in history.  Update it with this transaction.
-            self.history[idx][matched_order.order_id]['transactions'].append(
-                                                     (self.owner.currentTime, matched_order.quantity) )
+    # The pre-existing order may or may not still be in the recent history.
+    for idx, orders in enumerate(self.history):
+      if matched_order.order_id not in orders: continue
 
-          # Transaction occurred, so advance indices.
-          self.history.insert(0, {})
+      # Found the matched order in history.  Update it with this transaction.
+      self.history[idx][matched_order.order_id]['transactions'].append(
+                                               (self.owner.currentTime, matched_order.quantity) )
 
-          # Truncate history to required length.
-          self.history = self.history[:self.owner.stream_history+1]
+    # Transaction occurred, so advance indices.
+    self.history.insert(0, {})
 
+    # Truncate history to required length.
+    self.history = self.history[:self.owner.stream_history+1]
 
-          # Return (only the executed portion of) the matched order.
-          return matched_order
 
-      # No matching order found.
-      return None
+    # Return (only the executed portion of) the matched order.
+    return matched_order
 
 
   def isMatch (self, order, o):
@@ -241,26 +296,33 @@ class OrderBook:
 
     if order.is_buy_order:
       book = self.bids
+      levels = self.bid_levels
+      keys = self.bid_keys
     else:
       book = self.asks
+      levels = self.ask_levels
+      keys = self.ask_keys
+
+    # If there are already orders at this price, the order joins the back of that level.
+    level = levels.get(order.limit_price)
+    if level is not None:
+      level.orders.append(order)
+      level.total_qty += order.quantity
+      return
 
-    if not book:
-      # There were no orders on this side of the book.
-      book.append([order])
-    elif not self.isBetterPrice(order, book[-1][0]) and not self.isEqualPrice(order, book[-1][0]):
-      # There were orders on this side, but this order is worse than all of them.
-      # (New lowest bid or highest ask.)
-      book.append([order])
-    else:
-      # There are orders on this side.  Insert this order in the correct position in the list.
-      # Note that o is a LIST of all orders (oldest at index 0) at this same price.
-      for i, o in enumerate(book):
-        if self.isBetterPrice(order, o[0]):
-          book.insert(i, [order])
-          break
-        elif self.isEqualPrice(order, o[0]):
-          book[i].append(order)
-          break
+    # Otherwise it starts a new price level.
+    level = PriceLevel(order)
+    levels[order.limit_price] = level
+
+    # Insert the new level ahead of the first level with a worse price (a lower bid
+    # or a higher ask), or at the end if there is none.  (No orders on this side of
+    # the book, or a new lowest bid or highest ask.)  No level has this price yet,
+    # so the bisection lands exactly there.
+    key = -order.limit_price if order.is_buy_order else order.limit_price
+    i = bisect_left(keys, key)
+
+    book.insert(i, level)
+    keys.insert(i, key)
 
 
   def cancelOrder (self, order):
@@ -274,76 +336,67 @@ class OrderBook:
 
     if order.is_buy_order:
       book = self.bids
+      levels = self.bid_levels
+      keys = self.bid_keys
     else:
       book = self.asks
+      levels = self.ask_levels
+      keys = self.ask_keys
 
-    # If there are no orders on this side of the book, there is nothing to do.
-    if not book: return
+    # Find the price level of the order to cancel.  If there are no orders at
+    # that price, there is nothing to do.
+    level = levels.get(order.limit_price)
+    if level is None: return
 
-    # There are orders on this side.  Find the price level of the order to cancel,
-    # then find the exact order and cancel it.
-    # Note that o is a LIST of all orders (oldest at index 0) at this same price.
-    for i, o in enumerate(book):
-      if self.isEqualPrice(order, o[0]):
-        # This is the correct price level.
-        for ci, co in enumerate(book[i]):
-          if order.order_id == co.order_id:
-            # Cancel this order.
-            cancelled_order = book[i].pop(ci)
+    # Find the exact order and cancel it.
+    for ci, co in enumerate(level.orders):
+      if order.order_id == co.order_id:
+        # Cancel this order.
+        cancelled_order = co
+        del level.orders[ci]
+        level.total_qty -= cancelled_order.quantity
 
-            # Record cancellation of the order if it is still present in the recent history structure.
-            for idx, orders in enumerate(self.history):
-              if cancelled_order.order_id not in orders: continue
+        # Record cancellation of the order if it is still present in the recent history structure.
+        for idx, orders in enumerate(self.history):
+          if cancelled_order.order_id not in orders: continue
 
-              # Found the cancelled order in history.  Update it with the cancelation.
-              self.history[idx][cancelled_order.order_id]['cancellations'].append(
-                                                         (self.owner.currentTime, cancelled_order.quantity) )
+          # Found the cancelled order in history.  Update it with the cancelation.
+          self.history[idx][cancelled_order.order_id]['cancellations'].append(
+                                                     (self.owner.currentTime, cancelled_order.quantity) )
 
 
-            # If the cancelled price now has no orders, remove it completely.
-            if not book[i]:
-              del book[i]
+        # If the cancelled price now has no orders, remove it completely.
+        if not level.orders:
+          del levels[order.limit_price]
+          i = bisect_left(keys, -order.limit_price if order.is_buy_order else order.limit_price)
+          del book[i]
+          del keys[i]
 
-            print ("CANCELLED: order {}".format(order))
-            print ("SENT: notifications of order cancellation to agent {} for order {}".format(
-                   cancelled_order.agent_id, cancelled_order.order_id))
+        if not util.silent_mode:
+          print ("CANCELLED: order {}".format(order))
+          print ("SENT: notifications of order cancellation to agent {} for order {}".format(
+                 cancelled_order.agent_id, cancelled_order.order_id))
 
-            self.owner.sendMessage(order.agent_id, Message({ "msg": "ORDER_CANCELLED", "order": cancelled_order }))
+        self.owner.sendMessage(order.agent_id, Message({ "msg": "ORDER_CANCELLED", "order": cancelled_order }))
 
-            # We found the order and cancelled it, so stop looking.
-            return
+        # We found the order and cancelled it, so stop looking.
+        return
 
 
   # Get the inside bid price(s) and share volume available at each price, to a limit
   # of "depth".  (i.e. inside price, inside 2 prices)  Returns a list of tuples:
   # list index is best bids (0 is best); each tuple is (price, total shares).
   def getInsideBids (self, depth=sys.maxsize):
-    book = []
-    for i in range(min(depth, len(self.bids))):
-      qty = 0
-      price = self.bids[i][0].limit_price
-      for o in self.bids[i]:
-        qty += o.quantity
-      book.append( (price, qty) )
-
-    return book
+    return [ (level.price, level.total_qty) for level in self.bids[:depth] ]
 
 
   # As above, except for ask price(s).
   def getInsideAsks (self, depth=sys.maxsize):
-    book = []
-    for i in range(min(depth, len(self.asks))):
-      qty = 0
-      price = self.asks[i][0].limit_price
-      for o in self.asks[i]:
-        qty += o.quantity
-      book.append( (price, qty) )
-
-    return book
+    return [ (level.price, level.total_qty) for level in self.asks[:depth] ]
 
 
   # These could be moved to the LimitOrder class.  We could even operator overload them
-  # into >, <, ==, etc.
+  # into >, <, ==, etc.  (The book's own hot paths compare prices inline.)
   def isBetterPrice (self, order, o):
     # Returns True if order has a 'better' price than o.  (That is, a higher bid
     # or a lower ask.)  Must be same order type.
@@ -15,12 +15,14 @@
 
 import datetime as dt
 import numpy as np
-import pandas as pd
 import os, random, sys
 
 from math import sqrt
+from util import util
 from util.util import print
 
+# Number of standard normal draws made at once to refill the observation noise pool.
+NORMAL_POOL = 1024
 
 class MeanRevertingOracle:
 
@@ -32,6 +34,13 @@ class MeanRevertingOracle:
     self.symbols = symbols
     self.r = {}
 
+    # Fundamental values are held as plain arrays indexed by ns since market open (the
+    # series has one value per ns), so no time index is stored alongside them.
+    self.mkt_open_ns = self.mkt_open.value
+
+    # Offset of the last value, which is also given for any time at or after the close.
+    self.last_idx = (self.mkt_close - self.mkt_open).value - 1
+
     then = dt.datetime.now()
 
     for symbol in symbols:
@@ -39,6 +48,14 @@ class MeanRevertingOracle:
       print ("MeanRevertingOracle computing fundamental value series for {}".format(symbol))
       self.r[symbol] = self.generate_fundamental_value_series(symbol=symbol, **s)
 
+    # Pool of N(0,1) draws, scaled and shifted into observation noise on demand, so that
+    # the per-observation cost is a list pop rather than a call into np.random.
+    self.normal_pool = []
+
+    # Noise scale (std) for each observation variance seen, since agents each use one
+    # fixed sigma_n for the whole day.
+    self.noise_scale = {}
+
     now = dt.datetime.now()
 
     print ("MeanRevertingOracle initialized for symbols {}".format(symbols))
@@ -53,26 +70,22 @@ class MeanRevertingOracle:
     # Turn variance into std.
     sigma_s = sqrt(sigma_s)
 
-    # Create the time series into which values will be projected and initialize the first value.
-    date_range = pd.date_range(self.mkt_open, self.mkt_close, closed='left', freq='N')
-
-    s = pd.Series(index=date_range)
-    r = np.zeros(len(s.index))
-    r[0] = r_bar
+    # The series has one value per ns from the open up to, but not including, the close.
+    n = (self.mkt_close - self.mkt_open).value
 
     # Predetermine the random shocks for all time steps (at once, for computation speed).
-    shock = np.random.normal(scale=sigma_s, size=(r.shape[0]))
+    shock = np.random.normal(scale=sigma_s, size=n)
 
-    # Compute the mean reverting fundamental value series.
-    for t in range(1, r.shape[0]):
-      r[t] = max(0, (kappa * r_bar) + ( (1 - kappa) * r[t-1] ) + shock[t])
+    # Compute the mean reverting fundamental value series, starting from r_bar.
+    r = mean_reverting_series(r_bar, kappa, shock)
 
-    # Replace the series values with the fundamental value series.  Round and convert to
-    # integer cents.
-    s[:] = np.round(r)
-    s = s.astype(int)
+    # Round and convert to integer cents.  The recurrence stays in float64 (its
+    # closed-form block sums would lose whole cents in float32), but the stored series
+    # is int32 whenever the values fit, halving the memory it occupies for long runs.
+    r = np.round(r)
+    dtype = np.int32 if r.max() <= np.iinfo(np.int32).max else np.int64
     
-    return (s)
+    return r.astype(dtype)
 
 
   # Return the daily open price for the symbol given.  In the case of the MeanRevertingOracle,
@@ -86,7 +99,7 @@ class MeanRevertingOracle:
   
     print ("Oracle: client requested {} at market open: {}".format(symbol, self.mkt_open))
   
-    open = self.r[symbol].loc[self.mkt_open]
+    open = self.fundamentalValueAt(symbol, self.mkt_open)
     print ("Oracle: market open price was was {}".format(open))
   
     return open
@@ -100,20 +113,92 @@ class MeanRevertingOracle:
   #
   # sigma_n is experimental observation variance.  NOTE: NOT STANDARD DEVIATION.
   def observePrice(self, symbol, currentTime, sigma_n = 1000):
-    if currentTime >= self.mkt_close:
-      r_t = self.r[symbol].loc[self.mkt_close - pd.Timedelta('1ns')]
-    else:
-      r_t = self.r[symbol].loc[currentTime]
+    r_t = self.fundamentalValueAt(symbol, currentTime)
  
     # Generate a noisy observation of fundamental value at the current time.
     if sigma_n == 0:
       obs = r_t
     else:
-      obs = int(round(np.random.normal(loc=r_t, scale=sqrt(sigma_n))))
+      if not self.normal_pool:
+        # Stored reversed so pop() hands the draws out in the order they were made.
+        self.normal_pool = np.random.standard_normal(size=NORMAL_POOL)[::-1].tolist()
+      scale = self.noise_scale.get(sigma_n)
+      if scale is None: scale = self.noise_scale[sigma_n] = sqrt(sigma_n)
+      obs = int(round(r_t + scale * self.normal_pool.pop()))
  
-    print ("Oracle: current fundamental value is {} at {}".format(r_t, currentTime))
-    print ("Oracle: giving client value observation {}".format(obs))
+    if not util.silent_mode:
+      print ("Oracle: current fundamental value is {} at {}".format(r_t, currentTime))
+      print ("Oracle: giving client value observation {}".format(obs))
  
     # Reminder: all simulator prices are specified in integer cents.
     return obs
- 
+
+
+  # Return the (noise-free) fundamental value at the given time, as a Python int so
+  # that callers never do arithmetic in the narrow storage type.  Times at or after
+  # the close are given the closing value.
+  def fundamentalValueAt(self, symbol, currentTime):
+    # Works in int ns offsets, rather than comparing Timestamps, to keep this cheap.
+    t = currentTime.value - self.mkt_open_ns
+    if t < 0: raise KeyError(currentTime)
+    return int(self.r[symbol][min(t, self.last_idx)])
+
+
+# Computes r[t] = max(0, (kappa * r_bar) + ((1 - kappa) * r[t-1]) + shock[t]) for all t,
+# with r[0] = r_bar, and returns r.
+#
+# Without the clipping at zero, the deviation y[t] = r[t] - r_bar is the linear
+# recurrence y[t] = alpha * y[t-1] + shock[t] (alpha = 1 - kappa), which has the
+# closed form y[s+j] = alpha^j * (y[s] + sum over k = 1..j of alpha^-k * shock[s+k]).
+# That holds for any alpha, including the negative alpha (oscillating series) of
+# kappa > 1.  It is evaluated with numpy over blocks short enough that neither
+# alpha^-j nor alpha^j can overflow, each block starting from the last value of
+# the one before.  Where the
+# unclipped series would first go negative, the true value is exactly zero, so the
+# closed form simply restarts from there with y = -r_bar.  After a restart the
+# block size starts small and doubles back up, so that a series which clips often
+# does not recompute long blocks past every clipped step.
+def mean_reverting_series (r_bar, kappa, shock):
+  n = shock.shape[0]
+  r = np.empty(n)
+  r[0] = r_bar
+
+  alpha = 1.0 - kappa
+
+  # Longest block for which alpha^-j and alpha^j both stay within 1e150.  (With
+  # alpha = 0 there is no dependence on the previous value, and with |alpha| = 1
+  # no decay.)
+  if alpha == 0.0 or abs(alpha) == 1.0: block = n
+  else: block = max(1, int(150 * np.log(10) / abs(np.log(abs(alpha)))))
+
+  t = 1
+  y = 0.0
+  size = block
+  while t < n:
+    end = min(t + size, n)
+
+    if alpha == 0.0:
+      ys = shock[t:end]
+    else:
+      decay = alpha ** np.arange(1, end - t + 1)
+      ys = decay * (y + np.cumsum(shock[t:end] / decay))
+
+    values = r_bar + ys
+    negative = np.flatnonzero(values < 0)
+
+    if negative.size:
+      # Keep the values up to the clipped step, and restart from zero after it.
+      stop = t + negative[0]
+      r[t:stop] = values[:negative[0]]
+      r[stop] = 0.0
+      y = -r_bar
+      t = stop + 1
+      size = min(64, block)
+      continue
+
+    r[t:end] = values
+    y = ys[-1]
+    t = end
+    size = min(size * 2, block)
+
+  return r
@@ -2,7 +2,6 @@
 # Orders that typically go in an Exchange's OrderBook.
 
 from util.order.Order import Order
-from Kernel import Kernel
 from agent.FinancialAgent import dollarize
 
 import sys
@@ -12,10 +11,17 @@ silent_mode = False
 
 class LimitOrder (Order):
 
+  __slots__ = ('limit_price',)
+
   def __init__ (self, agent_id, time_placed, symbol, quantity, is_buy_order, limit_price):
     super().__init__(agent_id, time_placed, symbol, quantity, is_buy_order)
     self.limit_price = limit_price
 
+  def clone (self):
+    o = super().clone()
+    o.limit_price = self.limit_price
+    return o
+
   def __str__ (self):
     if silent_mode: return ''
 
@@ -25,7 +31,7 @@ class LimitOrder (Order):
     # Until we make explicit market orders, we make a few assumptions that EXTREME prices on limit
     # orders are trying to represent a market order.  This only affects printing - they still hit
     # the order book like limit orders, which is wrong.
-    return "(Agent {} @ {}) : {} {} {} @ {}{}".format(self.agent_id, Kernel.fmtTime(self.time_placed),
+    return "(Agent {} @ {}) : {} {} {} @ {}{}".format(self.agent_id, self.time_placed,
             "BUY" if self.is_buy_order else "SELL", self.quantity, self.symbol,
             dollarize(self.limit_price) if abs(self.limit_price) < sys.maxsize else 'MKT', filled)
 
@@ -4,7 +4,12 @@
 
 class Order:
 
-  order_id = 0
+  # Orders are created and copied constantly, so keep them free of a __dict__.
+  __slots__ = ('agent_id', 'time_placed', 'symbol', 'quantity', 'is_buy_order',
+               'order_id', 'fill_price')
+
+  # The next unique order_id to be assigned (simulation-wide).
+  next_order_id = 0
 
   def __init__(self, agent_id, time_placed, symbol, quantity, is_buy_order):
     self.agent_id = agent_id
@@ -14,11 +19,23 @@ class Order:
     self.is_buy_order = is_buy_order
 
     # Assign and increment the next unique order_id (simulation-wide).
-    self.order_id = Order.order_id
-    Order.order_id += 1
+    self.order_id = Order.next_order_id
+    Order.next_order_id += 1
 
     # Create placeholder fields that don't get filled in until certain
     # events happen.  (We could instead subclass to a special FilledOrder
     # class that adds these later?)
     self.fill_price = None
 
+  # Returns a copy of this order with the same order_id.  All fields are
+  # immutable values, so this is equivalent to (and far cheaper than) a deepcopy.
+  def clone(self):
+    o = self.__class__.__new__(self.__class__)
+    o.agent_id = self.agent_id
+    o.time_placed = self.time_placed
+    o.symbol = self.symbol
+    o.quantity = self.quantity
+    o.is_buy_order = self.is_buy_order
+    o.order_id = self.order_id
+    o.fill_price = self.fill_price
+    return o